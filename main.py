@@ -1,63 +1,143 @@
 import logging
 import re
 import sys
+import threading
 import tomllib
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
 from pathlib import Path
+from typing import BinaryIO
+from urllib.parse import urlparse
+from xml.etree.ElementTree import ParseError, iterparse
+from xml.parsers.expat import ExpatError
 
 import requests
+import urllib3
 import xmltodict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+_CFG_DIR = Path(__file__).parent
+
+_IMG_PARA_RE = re.compile(r'<p>.*?<img.*?</p>', re.DOTALL)
+_IMG_RE = re.compile(r'<img.*?>')
+_TAG_RE = re.compile(r'<[^>]*>')
+_IMG_SRC_RE = re.compile(r'<img.*?src="([^"]+/([^/]+?))".*?>')
+
 
 class DownloadWorker:
+    def __init__(self) -> None:
+        # One pooled session shared by all threads, so connections are kept alive between requests.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings['threads'],
+            pool_maxsize=settings['threads'] * 4,
+            max_retries=Retry(total=settings.get('retry', 3), backoff_factor=0.3,
+                              status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Attachments of a post are fetched concurrently instead of one after another.
+        self.download_executor = ThreadPoolExecutor(max_workers=settings['threads'] * 3)
+        # (url, file_path) pairs already fetched or being fetched by any thread.
+        self._seen_urls = set()
+        self._seen_lock = threading.Lock()
+        # Directories already created, so mkdir runs once per directory rather than once per file.
+        self._mkdir_cache: set[Path] = set()
+        # Caps in-flight requests per host so bursts across threads don't run into Tumblr's rate limits.
+        self._host_sem = defaultdict(lambda: threading.Semaphore(settings.get('host_connections', 8)))
+        self._host_sem_lock = threading.Lock()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Sends a GET through the shared session, bounded by the per-host semaphore."""
+        with self._host_sem_lock:
+            host_sem = self._host_sem[urlparse(url).hostname]
+        with host_sem:
+            return self.session.get(url=url, proxies=proxies, timeout=settings['timeout'], **kwargs)
+
     def download_posts(self, name: str, num: int, start: int, target_dir: Path) -> None:
         """Downloads blog posts from Tumblr API."""
         url = f"https://{name}.tumblr.com/api/read?num={num}&start={start}"
         logger.info(f"Fetching URL: {url}")
         try:
-            response = requests.get(url=url, proxies=proxies, timeout=settings['timeout'])
-            response.raise_for_status()
-            self.process_response(response.content, target_dir)
-        except requests.RequestException as e:
+            with self.get(url, stream=True) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                self.process_response(response.raw, target_dir)
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
             logger.error(f"Error fetching URL {url}: {e}")
 
-    def process_response(self, content: bytes, target_dir: Path) -> None:
-        """Processes API response and save posts."""
+    def process_response(self, stream: BinaryIO, target_dir: Path) -> None:
+        """Parses API response as it arrives and saves each post once its element is complete."""
+        saved = 0
+
+        def handle_post(path, post):
+            nonlocal saved
+            name, attrs = path[-1]
+            if name != "post":
+                return True
+            # In streaming mode xmltodict leaves the item's own attributes in the path.
+            post_attrs = {f"@{key}": value for key, value in (attrs or {}).items()}
+            post = post_attrs | (post if isinstance(post, dict) else {})
+            logger.info(f"Processing Post: {post.get('@id', 'Unknown ID')}")
+            self.save_post(post, target_dir)
+            saved += 1
+            return True
+
         try:
-            data = xmltodict.parse(content.decode('utf-8'))
-            posts = data.get("tumblr", {}).get("posts", {}).get("post", [])
-            if not posts:
-                logger.warning("No posts found.")
-                return
+            # <tumblr><posts><post> puts each post at depth 3.
+            xmltodict.parse(stream, item_depth=3, item_callback=handle_post)
+        except (KeyError, ExpatError) as e:
+            logger.error(f"Error processing response: {e}")
+            return
 
-            if isinstance(posts, dict):  # Handle case with a single post
-                posts = [posts]
+        if not saved:
+            logger.warning("No posts found.")
 
-            for post in posts:
-                logger.info(f"Processing Post: {post.get('@id', 'Unknown ID')}")
-                self.save_post(post, target_dir)
-        except (KeyError, UnicodeDecodeError) as e:
-            logger.error(f"Error processing response: {e}")
+    def ensure_dir(self, path: Path) -> None:
+        if path not in self._mkdir_cache:
+            path.mkdir(parents=True, exist_ok=True)
+            self._mkdir_cache.add(path)
+
+    def claim_download(self, url: str, file_path: Path) -> bool:
+        """Returns True if the caller should fetch url, False if it was seen before or is already on disk."""
+        with self._seen_lock:
+            if (url, file_path) in self._seen_urls:
+                return False
+            self._seen_urls.add((url, file_path))
+        return not file_path.exists()
 
     @staticmethod
-    def download_image(url: str, target_dir: Path) -> None:
-        target_dir.mkdir(parents=True, exist_ok=True)
-        response = requests.get(url=url, proxies=proxies, timeout=settings['timeout'])
+    def attachment_name(url: str) -> str:
+        """Returns the file name an attachment URL is saved under."""
+        return url.split('/')[-1] if url else ""
 
-        if response.status_code == 200:
-            image_name = url.split('/')[-1]
-            image_path = target_dir / image_name
+    def download_image(self, url: str, target_dir: Path) -> None:
+        self.ensure_dir(target_dir)
+        image_name = self.attachment_name(url)
+        image_path = target_dir / image_name
+        if not self.claim_download(url, image_path):
+            return
+
+        response = self.get(url)
 
-            with open(image_path, 'wb') as f:
-                f.write(response.content)
+        if response.status_code == 200:
+            image_path.write_bytes(response.content)
             logger.info(f"Downloaded: {image_name}")
         else:
             logger.error(f"Failed to download image from {url}")
 
+    def download_all(self, download, pairs: list[tuple[str, Path]]) -> None:
+        """Downloads (url, target_dir) pairs concurrently with the given download method."""
+        for _ in self.download_executor.map(lambda pair: download(*pair), pairs):
+            pass
+
     def regular_post_to_markdown(self, post: dict, target_dir: Path) -> str:
         title = f"# {post.get('regular-title', '')}\n\n"
 
@@ -75,21 +155,22 @@ class DownloadWorker:
         caption = post.get('photo-caption', '')
 
         attachment_dir = target_dir / 'attachments'
-        attachment_dir.mkdir(parents=True, exist_ok=True)
+        self.ensure_dir(attachment_dir)
 
         photoset = post.get('photoset', None)
 
-        photos = ""
-
         if photoset:
-            for photo in photoset.get("photo"):
-                max_width_url = photo["photo-url"][0]["#text"]
-                file_name = self.download_photo(max_width_url, attachment_dir)
-                photos += f'![[{file_name}]]\n\n'
+            urls = [photo["photo-url"][0]["#text"] for photo in photoset.get("photo")]
         else:
-            max_width_url = post["photo-url"][0]["#text"]
-            file_name = self.download_photo(max_width_url, attachment_dir)
-            photos += f'![[{file_name}]]\n\n'
+            urls = [post["photo-url"][0]["#text"]]
+
+        photos_list = []
+        for max_width_url in urls:
+            file_name = self.attachment_name(max_width_url)
+            photos_list.append(f'![[{file_name}]]\n\n')
+        photos = "".join(photos_list)
+
+        self.download_all(self.download_photo, [(url, attachment_dir) for url in urls])
 
         tags = post.get('tag', '').split()
         tag_str = ' '.join(f'#{tag}' for tag in tags)
@@ -98,25 +179,23 @@ class DownloadWorker:
         markdown = photos + caption + "\n" + tag_str
         return markdown
 
-    @staticmethod
-    def download_photo(url: str, target_dir: Path) -> str:
+    def download_photo(self, url: str, target_dir: Path) -> None:
         if not url:
-            return ""
+            return
 
-        file_name = url.split("/")[-1]
+        file_name = self.attachment_name(url)
         file_path = target_dir / file_name
+        if not self.claim_download(url, file_path):
+            return
 
         try:
-            response = requests.get(url)
+            response = self.get(url)
             response.raise_for_status()
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
+            file_path.write_bytes(response.content)
             logger.info(f"Downloaded: {file_name}")
         except requests.RequestException as e:
             logger.error(f"Failed to download {url}: {e}")
 
-        return file_name
-
     @staticmethod
     def chat_post_to_markdown(post: dict) -> str:
         title = f"# {post.get('conversation-title', '')}\n\n"
@@ -138,13 +217,10 @@ class DownloadWorker:
         file_path = target_dir / filename
 
         table_fields = ['@url-with-slug', '@type', '@date-gmt', '@date']
-        table_rows = ("| key | value |\n"
-                      "| --- | ----- |\n")
-
-        for field in table_fields:
-            key = field.replace('@', '')
-            value = post.get(field, '')
-            table_rows += f"| {key:<13} | {value} |\n"
+        table_rows = "".join(["| key | value |\n"
+                              "| --- | ----- |\n"] +
+                             [f"| {field.replace('@', ''):<13} | {post.get(field, '')} |\n"
+                              for field in table_fields])
 
         md_content = table_rows + "\n"
         post_type = post.get("@type", "")
@@ -159,66 +235,57 @@ class DownloadWorker:
             case _:
                 logger.error(f"Unknown post type: {post_type}")
 
+        md_bytes = md_content.encode("utf-8")
+
         try:
-            with file_path.open("w", encoding="utf-8") as f:
-                f.write(md_content)
+            # Leave files from a previous crawl untouched when the post hasn't changed.
+            if (file_path.exists() and file_path.stat().st_size == len(md_bytes)
+                    and file_path.read_bytes() == md_bytes):
+                logger.info(f"Post unchanged, skipped {file_path}")
+                return
+            file_path.write_bytes(md_bytes)
             logger.info(f"Saved post to {file_path}")
         except IOError as e:
             logger.error(f"Failed to save post to {file_path}: {e}")
 
     def handle_images(self, body: str, target_dir: Path) -> str:
-        img_paragraphs = self.extract_img_paragraphs(body)
-        updated_paragraphs = self.move_imgs_to_end(img_paragraphs)
-        updated_paragraphs = self.replace_img_with_markdown(updated_paragraphs, target_dir)
-        return self.update_body(body, img_paragraphs, updated_paragraphs)
-
-    @staticmethod
-    def extract_img_paragraphs(body):
-        img_paragraphs = re.findall(r'<p>.*?<img.*?</p>', body, re.DOTALL)
-        return img_paragraphs
-
-    @staticmethod
-    def move_imgs_to_end(paragraphs):
-        updated_paragraphs = []
-        img_pattern = re.compile(r'<img.*?>')
-
-        for paragraph in paragraphs:
-            imgs = img_pattern.findall(paragraph)
-            paragraph_without_imgs = img_pattern.sub('', paragraph).strip()
-
-            if re.sub(r'<[^>]*>', '', paragraph_without_imgs).strip() == '':
-                updated_paragraph = '\n\n' + '\n'.join(imgs)
-            else:
-                updated_paragraph = paragraph_without_imgs + '\n\n' + '\n'.join(imgs)
-
-            updated_paragraphs.append(updated_paragraph)
-
-        return updated_paragraphs
-
-    def replace_img_with_markdown(self, paragraphs, target_dir: Path):
-        updated_paragraphs = []
-        img_pattern = re.compile(r'<img.*?src="([^"]+/([^/]+?))".*?>')
-
         attachments_dir = target_dir / 'attachments'
-        attachments_dir.mkdir(parents=True, exist_ok=True)
+        self.ensure_dir(attachments_dir)
 
-        for paragraph in paragraphs:
-            def download_and_replace(match):
-                img_url = match.group(1)
-                img_filename = match.group(2)
-                self.download_image(img_url, attachments_dir)
-                return f'![[{img_filename}]]'
+        downloads = []
+        img_replacer = partial(self.img_replacer, attachments_dir, downloads)
+        body = _IMG_PARA_RE.sub(partial(self.rewrite_img_paragraph, img_replacer), body)
+        self.download_all(self.download_image, downloads)
+        return body
 
-            new_paragraph = img_pattern.sub(download_and_replace, paragraph)
-            updated_paragraphs.append(new_paragraph)
+    @staticmethod
+    def rewrite_img_paragraph(img_replacer, match: re.Match) -> str:
+        """Moves a paragraph's images to its end and rewrites them with img_replacer."""
+        paragraph = match.group(0)
+        imgs = []
+        parts = []
+        last = 0
+        for img_match in _IMG_RE.finditer(paragraph):
+            imgs.append(img_match.group(0))
+            parts.append(paragraph[last:img_match.start()])
+            last = img_match.end()
+        parts.append(paragraph[last:])
+        paragraph_without_imgs = "".join(parts).strip()
+
+        if _TAG_RE.sub('', paragraph_without_imgs).strip() == '':
+            updated_paragraph = '\n\n' + '\n'.join(imgs)
+        else:
+            updated_paragraph = paragraph_without_imgs + '\n\n' + '\n'.join(imgs)
 
-        return updated_paragraphs
+        return _IMG_SRC_RE.sub(img_replacer, updated_paragraph)
 
     @staticmethod
-    def update_body(body, old_paragraphs, new_paragraphs):
-        for old, new in zip(old_paragraphs, new_paragraphs):
-            body = body.replace(old, new)
-        return body
+    def img_replacer(attachments_dir: Path, downloads: list, match: re.Match) -> str:
+        """Queues an <img> for download into attachments_dir and returns its embed."""
+        img_url = match.group(1)
+        img_filename = match.group(2)
+        downloads.append((img_url, attachments_dir))
+        return f'![[{img_filename}]]'
 
 
 class CrawlerScheduler(object):
@@ -228,15 +295,19 @@ class CrawlerScheduler(object):
     def schedule_tasks(self) -> None:
         """Schedules download tasks for each blog."""
         with ThreadPoolExecutor(max_workers=settings['threads']) as executor:
+            # Probe every blog's post count in parallel before scheduling its pages.
+            totals = {name: executor.submit(self.get_total_post_count, name) for name in names}
+
             futures = []
-            for name in names:
-                total = self.get_total_post_count(name)
+            for name, total_future in totals.items():
+                total = total_future.result()
                 if total > 0:
                     futures.extend(self.schedule_blog_download(executor, name, total))
 
             for future in futures:
                 future.result()
             logger.info("Completed downloading all posts.")
+        self.worker.download_executor.shutdown()
 
     def schedule_blog_download(self, executor: ThreadPoolExecutor, name: str, total: int) -> list:
         """Schedules the download tasks for a specific blog."""
@@ -249,27 +320,33 @@ class CrawlerScheduler(object):
             futures.append(executor.submit(self.worker.download_posts, name, num, start, target_dir))
         return futures
 
-    @staticmethod
-    def get_total_post_count(name: str) -> int:
+    def get_total_post_count(self, name: str) -> int:
         """Retrieves the total number of posts for a blog."""
-        url = f"https://{name}.tumblr.com/api/read"
+        url = f"https://{name}.tumblr.com/api/read?num=1"
         try:
-            response = requests.get(url=url, proxies=proxies, timeout=settings['timeout'])
+            response = self.worker.get(url)
             response.raise_for_status()
             if response.status_code == 404:
                 logger.warning(f"{name} doesn't exist.")
                 return 0
-            data = xmltodict.parse(response.content.decode('utf-8'))
-            total_posts = data["tumblr"]["posts"]["@total"]
+            # Only the total attribute on <posts> is needed, so stop at its start tag.
+            total_posts = None
+            for _, elem in iterparse(BytesIO(response.content), events=("start",)):
+                if elem.tag == "posts":
+                    total_posts = elem.get("total")
+                    break
+            if total_posts is None:
+                logger.error(f"Failed to retrieve post count for {name}: response has no total attribute on <posts>.")
+                return 0
             logger.info(f"{name} has {total_posts} posts.")
             return int(total_posts)
-        except (requests.RequestException, KeyError, UnicodeDecodeError) as e:
+        except (requests.RequestException, ParseError) as e:
             logger.error(f"Failed to retrieve post count for {name}: {e}")
             return 0
 
 
 def load_config() -> dict:
-    config_file = Path(__file__).resolve().parent / "config.toml"
+    config_file = _CFG_DIR / "config.toml"
 
     try:
         with config_file.open("rb") as f: